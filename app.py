@@ -1,63 +1,581 @@
-from flask import Flask, render_template, jsonify, request
-from flask_socketio import SocketIO, emit
 import os
+
+# Green-thread servers need the standard library patched before anything
+# else imports it
+ASYNC_MODE = os.environ.get('FOAMCHALAK_ASYNC_MODE', 'threading')
+if ASYNC_MODE == 'eventlet':
+    import eventlet
+    eventlet.monkey_patch()
+elif ASYNC_MODE == 'gevent':
+    from gevent import monkey
+    monkey.patch_all()
+
+from flask import Flask, Response, render_template, jsonify, request, session
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.wsgi import wrap_file
+from flask_socketio import SocketIO, emit, join_room, leave_room, rooms
 import sys
 import subprocess
 import threading
-import json
+import concurrent.futures
 import time
+import queue
+import selectors
+import codecs
+from collections import deque
 import shutil
-import psutil
-import docker
+import uuid
+import atexit
+import io
+import tarfile
+import tempfile
+import platform
+import socket
+import errno
+import hashlib
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+import orjson
 from datetime import datetime
 
+# Paths resolved once at import
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+RUNS_ROOT = os.path.join(BASE_DIR, 'runs')
+CACHE_ROOT = os.environ.get('FOAMCHALAK_CACHE_DIR', os.path.join(BASE_DIR, 'cache'))
+os.makedirs(RUNS_ROOT, exist_ok=True, mode=0o755)
+
+# Status messages are print()ed, so flush them per line even when stdout
+# is a pipe (gunicorn, docker logs) rather than a terminal
+if hasattr(sys.stdout, 'reconfigure'):
+    sys.stdout.reconfigure(line_buffering=True)
+
+class OrjsonProvider(DefaultJSONProvider):
+    """JSON provider that encodes API responses with orjson"""
+    
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+    
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj, default=self.default), mimetype=self.mimetype)
+
+class OrjsonSocketJSON:
+    """json module stand-in that encodes Socket.IO packets with orjson"""
+    
+    @staticmethod
+    def dumps(obj, **kwargs):
+        # orjson output is always compact, so separators are ignored
+        return orjson.dumps(obj).decode()
+    
+    @staticmethod
+    def loads(s, **kwargs):
+        return orjson.loads(s)
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 app.config['SECRET_KEY'] = 'your-secret-key'
-socketio = SocketIO(app, cors_allowed_origins="*")
+# Log batches are repetitive text, so compress long-polling responses over
+# 256 bytes; websocket frames are sent uncompressed
+socketio = SocketIO(
+    app,
+    async_mode=ASYNC_MODE,
+    cors_allowed_origins="*",
+    http_compression=True,
+    compression_threshold=256,
+    json=OrjsonSocketJSON
+)
+
+# Run bookkeeping, keeping finished runs up to RECENT_OUTPUT_RUNS; guarded
+# by _proc_lock
+_proc_lock = threading.Lock()
+app.running_simulations = {}
+
+# Runs execute on long-lived worker threads, at most this many at once
+MAX_CONCURRENT_RUNS = max(1, int(os.environ.get('FOAMCHALAK_MAX_RUNS', '1')))
+SIM_EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=MAX_CONCURRENT_RUNS, thread_name_prefix='sim')
+_pending_starts = 0  # Runs being set up that don't have a future yet
+atexit.register(SIM_EXECUTOR.shutdown, wait=False)
+
+# Tail of recent output lines per run so late-joining clients can catch up;
+# only the most recent runs' tails are kept
+RECENT_OUTPUT_SIZE = 1000
+RECENT_OUTPUT_RUNS = 10
+recent_output = {}  # run_id -> deque of {'data', 'timestamp'}, oldest run first
+_output_lock = threading.Lock()
+
+# Output lines are streamed to clients in batches rather than one frame per line
+OUTPUT_BATCH_LINES = 50
+OUTPUT_BATCH_INTERVAL = 0.05  # seconds
+OUTPUT_QUEUE_SIZE = 1000  # chunks (one per read), not lines
+OUTPUT_STALL_TIMEOUT = 1.0  # seconds the reader waits on a full queue before dropping
+OUTPUT_READ_SIZE = 65536
+
+# OpenFOAM image and environment used for simulation runs
+OPENFOAM_IMAGE = 'haldardhruv/ubuntu_noble_openfoam:v2412'
+OPENFOAM_BASHRC = '/usr/lib/openfoam/openfoam2412/etc/bashrc'
+OPENFOAM_USER_PLATFORM = '/case/platforms/linux64GccDPInt32Opt'
+TUTORIAL_SRC = '/usr/lib/openfoam/openfoam2412/tutorials/incompressible/simpleFoam/pitzDaily'
+TUTORIAL_REQUIRED_FILES = frozenset({
+    '0/U', '0/p', 'system/controlDict',
+    'system/fvSchemes', 'system/fvSolution', 'system/blockMeshDict'
+})
+
+# Steps of a run, in the order they execute
+STEP_ORDER = ('blockMesh', 'checkMesh', 'potentialFoam', 'simpleFoam', 'postProcessing')
+
+# Log buffering and graceful stop timeout
+LOG_BUFFER_SIZE = 65536  # Log writes are batched into this many bytes per write()
+STOP_TIMEOUT = 5  # seconds
+
+# Docker CLI used for step execs, resolved once so it can be spawned by path
+DOCKER_CLI = shutil.which('docker') or 'docker'
+
+# Containers run as the app's user so case files stay owned by it; Windows
+# has no uid/gid, so there the image's default user is kept
+RUN_USER = f"{os.getuid()}:{os.getgid()}" if hasattr(os, 'getuid') else None
+
+# Docker Desktop shares host dirs through a slow file-sharing layer, so let
+# the container's writes to the case land first; Linux bind mounts are native
+CASE_MOUNT_MODE = 'rw,delegated' if platform.system() in ('Darwin', 'Windows') else 'rw'
+
+# How long health-check results are reused by the polling endpoints
+DOCKER_STATUS_TTL = 2.0  # seconds
+DISK_USAGE_TTL = 1.0  # seconds
+INV_GIB = 1.0 / (1 << 30)  # Bytes to GiB
+_status_cache = {}
+
+# Prefix of the step progress lines printed by the run script
+STEP_MARKER = '##FOAMCHALAK_STEP:'
+
+# Heavy modules, imported on first use by load_docker() and load_psutil()
+docker = None
+psutil = None
+
+# Docker client shared by all requests, created on first use
+_docker_client = None
+_docker_client_lock = threading.Lock()
+
+# OpenFOAM image, resolved (and pulled if missing) on first use, and the
+# environment its bashrc sets up
+_openfoam_image = None
+_openfoam_env = None
+_image_lock = threading.Lock()
+# Serializes the image lookup and pull, which can take minutes; _image_lock
+# is never held across it
+_image_pull_lock = threading.Lock()
+
+# Serializes filling the host-side tutorial cache
+_tutorial_lock = threading.Lock()
+
+# Set once the background cache warm-up has been started
+_warm_up_started = False
+_warm_up_lock = threading.Lock()
+
+# Rendered index page as UTF-8 bytes, filled on first request
+_index_html = None
+
+# Ids of containers of runs in progress, removed on exit if still alive
+_run_containers = set()
+
+# Labels on run containers naming the run and the app process that owns
+# them, so ones left behind by a process that died without atexit can be
+# found and removed. Pids are per host (and per pid namespace) and get
+# reused, so the owner is its hostname, pid and process start time.
+RUN_LABEL = 'foamchalak.run'
+OWNER_HOST_LABEL = 'foamchalak.host'
+OWNER_PID_LABEL = 'foamchalak.pid'
+OWNER_STARTED_LABEL = 'foamchalak.started'
+_owner_labels = None
+
+# Linux ioctl that makes dst share src's extents on copy-on-write
+# filesystems (btrfs, XFS); cleared once the filesystem turns out not to,
+# and never tried where fcntl doesn't exist
+FICLONE = 0x40049409
+_reflink_supported = fcntl is not None
+
+def load_docker():
+    """Import the Docker SDK on first use; it is slow to import."""
+    global docker
+    if docker is None:
+        import docker as docker_module
+        docker = docker_module
+    return docker
+
+def load_psutil():
+    """Import psutil on first use."""
+    global psutil
+    if psutil is None:
+        import psutil as psutil_module
+        psutil = psutil_module
+    return psutil
+
+def get_docker_client():
+    """Return the shared Docker client, connecting on first use."""
+    global _docker_client
+    with _docker_client_lock:
+        if _docker_client is None:
+            _docker_client = load_docker().from_env()
+        return _docker_client
+
+def get_openfoam_image():
+    """Return the local OpenFOAM image, pulling it once if it isn't present.
+    
+    Containers are created from the cached image id, so later runs never
+    go back to the registry.
+    """
+    global _openfoam_image
+    with _image_lock:
+        if _openfoam_image is not None:
+            return _openfoam_image
+    
+    with _image_pull_lock:
+        with _image_lock:
+            image = _openfoam_image
+        if image is None:
+            client = get_docker_client()
+            try:
+                image = client.images.get(OPENFOAM_IMAGE)
+            except docker.errors.ImageNotFound:
+                print(f"📥 Pulling {OPENFOAM_IMAGE}...")
+                repository, tag = OPENFOAM_IMAGE.rsplit(':', 1)
+                image = client.images.pull(repository, tag=tag)
+            with _image_lock:
+                _openfoam_image = image
+        return image
+
+def get_image_cache_dir():
+    """Return the host-side cache directory for the current OpenFOAM image."""
+    return os.path.join(CACHE_ROOT, get_openfoam_image().short_id.split(':')[-1])
+
+def get_openfoam_env():
+    """Return the OpenFOAM environment for run containers, captured once.
+    
+    The bashrc is sourced in a throwaway container and the resulting
+    environment, pointed at the /case user directories, is passed to each
+    run container when it is created. It is also saved in the image's cache
+    directory, so later processes skip the container entirely.
+    """
+    global _openfoam_env
+    with _image_lock:
+        if _openfoam_env is not None:
+            return _openfoam_env
+    
+    script = (
+        # Initialize OpenFOAM environment
+        f'source {OPENFOAM_BASHRC} && '
+        # Set environment variables
+        'export FOAM_RUN=/case && '
+        'export WM_PROJECT_USER_DIR=/case && '
+        f'export FOAM_USER_LIBBIN={OPENFOAM_USER_PLATFORM}/lib && '
+        f'export FOAM_USER_APPBIN={OPENFOAM_USER_PLATFORM}/bin && '
+        f'export LD_LIBRARY_PATH={OPENFOAM_USER_PLATFORM}/lib:$LD_LIBRARY_PATH && '
+        f'export PATH={OPENFOAM_USER_PLATFORM}/bin:$PATH && '
+        'env -0'
+    )
+    # The environment depends on the script and the user it runs as
+    script_key = hashlib.sha1(f'{RUN_USER}\0{script}'.encode('utf-8')).hexdigest()[:12]
+    image_dir = get_image_cache_dir()
+    env_cache = os.path.join(image_dir, f'openfoam_env_{script_key}.json')
+    
+    try:
+        with open(env_cache, 'rb') as f:
+            env = orjson.loads(f.read())
+    except (FileNotFoundError, orjson.JSONDecodeError):
+        output = get_docker_client().containers.run(
+            get_openfoam_image().id,
+            ['bash', '-c', script],
+            user=RUN_USER,
+            remove=True
+        )
+        
+        env = {}
+        for entry in output.decode('utf-8', errors='replace').split('\0'):
+            key, sep, value = entry.partition('=')
+            if sep and key not in ('HOSTNAME', 'PWD', 'SHLVL', '_'):
+                env[key] = value
+        
+        # Write atomically so a concurrent process never reads a partial
+        # file; the cache is only an optimization, so failures are not fatal
+        try:
+            os.makedirs(image_dir, exist_ok=True, mode=0o755)
+            fd, tmp_path = tempfile.mkstemp(dir=image_dir, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(orjson.dumps(env))
+                os.replace(tmp_path, env_cache)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        except OSError as e:
+            print(f"⚠️ Could not cache the OpenFOAM environment: {str(e)}", file=sys.stderr)
+    
+    with _image_lock:
+        _openfoam_env = env
+    return env
+
+def remove_container(container_id):
+    """Force-remove a container by id, ignoring ones that are already gone."""
+    if container_id is None:
+        return
+    try:
+        get_docker_client().api.remove_container(container_id, force=True)
+    except docker.errors.NotFound:
+        pass
+    except docker.errors.APIError as e:
+        print(f"❌ Failed to remove container {container_id[:12]}: {str(e)}", file=sys.stderr)
+
+def terminate_process(process, timeout=STOP_TIMEOUT):
+    """Terminate a step's docker exec CLI, killing it if it lingers."""
+    if process.poll() is None:
+        process.terminate()
+    try:
+        process.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+def clone_file(src, dst):
+    """Copy a file as a reflink where the filesystem allows it
+    
+    A reflink only copies metadata; the data is shared until either side
+    writes to it. Falls back to a regular copy everywhere else.
+    """
+    global _reflink_supported
+    if _reflink_supported:
+        try:
+            with open(src, 'rb') as src_f, open(dst, 'wb') as dst_f:
+                fcntl.ioctl(dst_f.fileno(), FICLONE, src_f.fileno())
+        except OSError as e:
+            if e.errno in (errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL, errno.EXDEV):
+                _reflink_supported = False
+        else:
+            shutil.copystat(src, dst)
+            return dst
+    return shutil.copy2(src, dst)
+
+def extract_tutorial(tutorial_src, run_dir):
+    """Copy a tutorial case out of the OpenFOAM image into run_dir
+    
+    The files are read from a created (never started) container with
+    get_archive, so no container runtime or in-container copy is needed.
+    """
+    api = get_docker_client().api
+    tutorial_container = api.create_container(get_openfoam_image().id)['Id']
+    try:
+        bits, _ = api.get_archive(tutorial_container, tutorial_src)
+        archive = io.BytesIO(b''.join(bits))
+    finally:
+        remove_container(tutorial_container)
+    
+    with tarfile.open(fileobj=archive, mode='r:') as tar:
+        # Strip the leading tutorial directory so files land directly in run_dir
+        members = []
+        for member in tar.getmembers():
+            parts = member.name.split('/', 1)
+            if len(parts) < 2 or not parts[1]:
+                continue
+            member.name = parts[1]
+            if os.path.isabs(member.name) or '..' in member.name.split('/'):
+                raise tarfile.TarError(f"Unsafe path in tutorial archive: {member.name}")
+            members.append(member)
+        tar.extractall(run_dir, members=members)
+
+def scan_case_files(case_dir):
+    """Return the 'subdir/name' entries of a case's 0, constant and system dirs
+    
+    Entries are made writable by the run user along the way, so each
+    directory is listed once for both the permission fix and the check.
+    """
+    present = set()
+    for subdir in ('0', 'constant', 'system'):
+        try:
+            with os.scandir(os.path.join(case_dir, subdir)) as entries:
+                for entry in entries:
+                    os.chmod(entry.path, 0o755 if entry.is_dir() else 0o644)
+                    present.add(f'{subdir}/{entry.name}')
+        except FileNotFoundError:
+            continue
+    return present
+
+def get_cached_tutorial():
+    """Return the host-side copy of the tutorial, extracting it on first use.
+    
+    The case is pulled out of the image once and verified; every run then
+    copies it from disk without touching Docker. The cache is keyed by
+    image id, so a new image is picked up without clearing the cache.
+    """
+    image_dir = get_image_cache_dir()
+    tutorial_cache = os.path.join(image_dir, os.path.basename(TUTORIAL_SRC))
+    with _tutorial_lock:
+        if not os.path.isdir(tutorial_cache):
+            os.makedirs(image_dir, exist_ok=True, mode=0o755)
+            staging_dir = tempfile.mkdtemp(dir=image_dir)
+            try:
+                extract_tutorial(TUTORIAL_SRC, staging_dir)
+                
+                # Verify essential files were extracted
+                missing = TUTORIAL_REQUIRED_FILES - scan_case_files(staging_dir)
+                if missing:
+                    raise FileNotFoundError(f"Required files were not copied from the tutorial: {', '.join(sorted(missing))}")
+                
+                os.chmod(staging_dir, 0o755)
+                os.rename(staging_dir, tutorial_cache)
+            except BaseException:
+                shutil.rmtree(staging_dir, ignore_errors=True)
+                raise
+        return tutorial_cache
 
-# Global variables to store process information
-current_process = None
-process_output = []
+@atexit.register
+def cleanup_run_containers():
+    for container_id in list(_run_containers):
+        remove_container(container_id)
+    _run_containers.clear()
+
+def get_owner_labels():
+    """Return the labels identifying this app process as a container's owner."""
+    global _owner_labels
+    if _owner_labels is None:
+        _owner_labels = {
+            OWNER_HOST_LABEL: socket.gethostname(),
+            OWNER_PID_LABEL: str(os.getpid()),
+            OWNER_STARTED_LABEL: repr(load_psutil().Process().create_time())
+        }
+    return _owner_labels
+
+def is_owner_dead(labels):
+    """Check whether the app process named by a container's labels has exited.
+    
+    Only owners on this host can be judged; a pid that now belongs to a
+    process started at another time has been reused.
+    """
+    if labels.get(OWNER_HOST_LABEL) != socket.gethostname():
+        return False
+    try:
+        pid = int(labels[OWNER_PID_LABEL])
+        started = float(labels[OWNER_STARTED_LABEL])
+    except (KeyError, ValueError):
+        return False
+    load_psutil()
+    try:
+        return abs(psutil.Process(pid).create_time() - started) >= 1.0
+    except psutil.NoSuchProcess:
+        return True
+
+def remove_stale_run_containers():
+    """Remove run containers whose owning app process is no longer alive.
+    
+    Run containers idle with 'sleep infinity', so one orphaned by a killed
+    or crashed app would otherwise run forever with its run directory
+    mounted.
+    """
+    api = get_docker_client().api
+    for info in api.containers(all=True, filters={'label': RUN_LABEL}):
+        if not is_owner_dead(info.get('Labels') or {}):
+            continue
+        print(f"🧹 Removing stale run container {info['Id'][:12]}")
+        remove_container(info['Id'])
+
+def start_warm_up():
+    """Prepare the image, tutorial and environment caches in the background.
+    
+    Runs once per process, so the first simulation doesn't pull the image
+    or extract the tutorial itself. Containers orphaned by a previous app
+    process are removed first. Called at startup and on the first page
+    load, which also covers servers like gunicorn that skip __main__.
+    """
+    global _warm_up_started
+    with _warm_up_lock:
+        if _warm_up_started:
+            return
+        _warm_up_started = True
+    
+    def warm_up():
+        try:
+            remove_stale_run_containers()
+        except Exception as e:
+            print(f"⚠️ Could not clean up stale run containers: {str(e)}", file=sys.stderr)
+        try:
+            image = get_openfoam_image()
+            print(f"✅ Using {OPENFOAM_IMAGE} ({image.short_id})")
+            get_cached_tutorial()
+            get_openfoam_env()
+        except Exception as e:
+            print(f"⚠️ Could not prepare {OPENFOAM_IMAGE}: {str(e)}", file=sys.stderr)
+    socketio.start_background_task(warm_up)
 
 @app.route('/')
 def index():
-    return render_template('index.html')
+    global _index_html
+    start_warm_up()
+    # The page only varies with flashed messages, so reuse the rendered
+    # HTML whenever there are none to show
+    if app.debug or '_flashes' in session:
+        return render_template('index.html')
+    if _index_html is None:
+        _index_html = render_template('index.html').encode('utf-8')
+    return Response(_index_html, mimetype='text/html')
+
+def _active_simulations():
+    """Return the number of runs in progress. Caller must hold _proc_lock."""
+    return sum(not sim['future'].done() for sim in app.running_simulations.values())
+
+def _find_simulation(run_id=None):
+    """Return the named run, or the most recent one. Caller must hold _proc_lock."""
+    if run_id:
+        return app.running_simulations.get(run_id)
+    if app.running_simulations:
+        return next(reversed(app.running_simulations.values()))
+    return None
 
 @app.route('/api/run_simulation', methods=['POST'])
 def run_simulation():
-    global current_process
+    global _pending_starts
     
-    if current_process and current_process.poll() is None:
-        return jsonify({'status': 'error', 'message': 'A simulation is already running'}), 400
+    # Reserve a run slot, then set up without holding the lock so status
+    # and stop requests for other runs aren't held up
+    with _proc_lock:
+        if _active_simulations() + _pending_starts >= MAX_CONCURRENT_RUNS:
+            return jsonify({'status': 'error', 'message': 'A simulation is already running'}), 400
+        _pending_starts += 1
+    # Socket.IO id of the requesting client, subscribed before the run starts
+    sid = (request.get_json(silent=True) or {}).get('sid')
+    try:
+        return _start_simulation(sid)
+    finally:
+        with _proc_lock:
+            _pending_starts -= 1
+
+def _start_simulation(sid=None):
+    # Fail fast while the client is still waiting on the request; the image
+    # and tutorial are prepared on the simulation worker
+    try:
+        get_docker_client().ping()
+    except Exception as e:
+        error_msg = f"Docker is not available: {str(e)}"
+        print(f"❌ {error_msg}")
+        return jsonify({
+            'status': 'error',
+            'message': error_msg
+        }), 500
     
     # Initialize variables that need cleanup in case of error
     run_dir = None
     
     try:
-        # Get the path to the Python interpreter in the virtual environment
-        python_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'venv', 'bin', 'python')
-        script_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'foamlib_docker_test.py')
-        
-        # Verify that the script exists
-        if not os.path.exists(script_path):
-            raise FileNotFoundError(f"Simulation script not found at {script_path}")
-        
-        # Create base directory for runs if it doesn't exist
-        base_runs_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'runs')
-        os.makedirs(base_runs_dir, exist_ok=True, mode=0o755)
-        
-        # Create a timestamped run directory with required subdirectories
+        # Create a timestamped run directory; the random suffix keeps runs
+        # started in the same second apart
         timestamp = time.strftime('%Y%m%d_%H%M%S')
-        run_dir = os.path.join(base_runs_dir, f'run_{timestamp}')
+        run_id = f'run_{timestamp}_{uuid.uuid4().hex[:6]}'
+        run_dir = os.path.join(RUNS_ROOT, run_id)
         
-        # Ensure the run directory is created with the correct permissions
+        # RUNS_ROOT exists from import; the case subdirectories come with
+        # the tutorial copy
         try:
-            os.makedirs(run_dir, mode=0o755, exist_ok=True)
-            os.chmod(run_dir, 0o755)  # Ensure directory is writable
-            
-            # Create necessary subdirectories
-            for subdir in ['0', 'constant', 'system']:
-                os.makedirs(os.path.join(run_dir, subdir), mode=0o755, exist_ok=True)
+            os.mkdir(run_dir, 0o755)
                 
         except Exception as e:
             error_msg = f"Failed to create run directory {run_dir}: {str(e)}"
@@ -75,406 +593,384 @@ def run_simulation():
             'message': error_msg
         }), 500
         
-        # Copy tutorial files from the Docker container
-        tutorial_src = "/usr/lib/openfoam/openfoam2412/tutorials/incompressible/simpleFoam/pitzDaily"
-        try:
-            print(f"📂 Copying tutorial files from {tutorial_src} to {run_dir}")
-            
-            # Run a container to copy files from the tutorial directory with correct user permissions
-            copy_cmd = [
-                'docker', 'run', '--rm',
-                '-u', f"{os.getuid()}:{os.getgid()}",  # Run as current user
-                '-v', f"{run_dir}:/target",
-                '--workdir', '/target',
-                'haldardhruv/ubuntu_noble_openfoam:v2412',
-                'bash', '-c', (
-                    # Create destination directories first
-                    'mkdir -p /target/0 /target/constant /target/system && ' \
-                    # Copy files from each directory separately to avoid permission issues
-                    'cp -r /usr/lib/openfoam/openfoam2412/tutorials/incompressible/simpleFoam/pitzDaily/0/* /target/0/ && ' \
-                    'cp -r /usr/lib/openfoam/openfoam2412/tutorials/incompressible/simpleFoam/pitzDaily/constant/* /target/constant/ && ' \
-                    'cp -r /usr/lib/openfoam/openfoam2412/tutorials/incompressible/simpleFoam/pitzDaily/system/* /target/system/ && ' \
-                    # Set correct permissions on all files and directories
-                    'find /target -type d -exec chmod 755 {} \; && ' \
-                    'find /target -type f -exec chmod 644 {} \; && ' \
-                    # Make sure key executables have execute permissions
-                    'chmod 755 /target/All* /target/Allrun* /target/Allclean* 2>/dev/null || true'
-                )
-            ]
-            
-            # Run the copy command and capture output
-            try:
-                copy_process = subprocess.run(
-                    copy_cmd,
-                    check=True,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    text=True
-                )
-                
-                # Print command output for debugging
-                if copy_process.stdout:
-                    print(f"Copy command output: {copy_process.stdout}")
-                
-                print("✅ Successfully copied tutorial files")
-                
-                # Verify essential files were copied
-                required_files = [
-                    '0/U', '0/p', '0/nut', '0/k', '0/epsilon', '0/omega', '0/nuTilda',
-                    'system/controlDict', 'system/fvSchemes', 'system/fvSolution', 
-                    'system/blockMeshDict', 'constant/transportProperties',
-                    'constant/turbulenceProperties'
-                ]
-                
-                missing_files = []
-                for file in required_files:
-                    file_path = os.path.join(run_dir, file)
-                    if not os.path.exists(file_path):
-                        missing_files.append(file)
-                
-                if missing_files:
-                    raise FileNotFoundError(
-                        f"The following required files were not copied: {', '.join(missing_files)}. "
-                        f"Please check if the tutorial files exist in the Docker container."
-                    )
-                    
-            except subprocess.CalledProcessError as e:
-                error_msg = (
-                    f"Failed to copy tutorial files. Command failed with code {e.returncode}.\n"
-                    f"Error output: {e.stderr}\n"
-                    f"Command: {' '.join(copy_cmd[:5])} [command truncated]"
-                )
-                print(f"❌ {error_msg}")
-                return jsonify({
-                    'status': 'error',
-                    'message': error_msg
-                }), 500
-                    
-        except subprocess.CalledProcessError as e:
-            error_msg = f"Failed to copy tutorial files: {e.stderr}"
-            print(f"❌ {error_msg}")
-            return jsonify({
-                'status': 'error',
-                'message': error_msg
-            }), 500
-        except Exception as e:
-            error_msg = f"Error setting up tutorial case: {str(e)}"
-            print(f"❌ {error_msg}")
-            return jsonify({
-                'status': 'error',
-                'message': error_msg
-            }), 500
-        
-        # Set environment variables
-        env = os.environ.copy()
-        env['PYTHONUNBUFFERED'] = '1'  # Ensure output is not buffered
-        env['FOAMCHALAK_RUN_DIR'] = run_dir
-        
-        # Ensure log directory exists
-        log_dir = os.path.dirname(run_dir)
-        if not os.path.exists(log_dir):
-            os.makedirs(log_dir, exist_ok=True, mode=0o755)
-            
-        # Log the start of the simulation
-        log_file = os.path.join(run_dir, 'simulation.log')
+    # Log the start of the simulation
+    log_file = os.path.join(run_dir, 'simulation.log')
+    try:
+        header = (f"Starting simulation at {time.ctime()}\n"
+                  f"Run directory: {run_dir}\n"
+                  + "=" * 80 + "\n\n").encode('utf-8')
+        fd = os.open(log_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
         try:
-            with open(log_file, 'w') as f:
-                f.write(f"Starting simulation at {time.ctime()}\n")
-                f.write(f"Run directory: {run_dir}\n")
-                f.write("=" * 80 + "\n\n")
-        except IOError as e:
-            app.logger.error(f"Failed to create log file {log_file}: {str(e)}")
-            return jsonify({
-                'status': 'error', 
-                'message': f'Failed to create log file: {str(e)}'
-            }), 500
-        
-        # Copy tutorial files from the Docker container
-        tutorial_src = "/usr/lib/openfoam/openfoam2412/tutorials/incompressible/simpleFoam/pitzDaily"
+            os.write(fd, header)
+        finally:
+            os.close(fd)
+    except IOError as e:
+        app.logger.error(f"Failed to create log file {log_file}: {str(e)}")
+        return jsonify({
+            'status': 'error', 
+            'message': f'Failed to create log file: {str(e)}'
+        }), 500
+    
+    # Store process information
+    process_info = {
+        'start_time': time.time(),
+        'start_monotonic': time.monotonic_ns(),
+        'run_dir': run_dir,
+        'log_file': log_file,
+        'current_step': 'initializing',
+        # Keyed by step name for direct status updates
+        'steps': {name: {'name': name, 'status': 'pending'} for name in STEP_ORDER}
+    }
+    
+    # Function to update step status
+    def update_step_status(step_name, status):
+        step = process_info['steps'].get(step_name)
+        if step is None:
+            return
+        step['status'] = status
+        socketio.emit('step_update', {
+            'step': step_name,
+            'status': status,
+            'timestamp': time.time(),
+            'run_id': run_id
+        }, to=run_id)
+    
+    # Function to copy the cached tutorial case into the run directory.
+    # Files are reflinked or copied rather than hardlinked since solvers
+    # rewrite 0/ in place. The first run may pull the image, so this
+    # happens on the simulation worker rather than in the request.
+    def copy_tutorial():
         try:
-            # Run a container to copy files from the tutorial directory
-            copy_cmd = [
-                'docker', 'run', '--rm',
-                '-v', f"{run_dir}:/target",
-                'haldardhruv/ubuntu_noble_openfoam:v2412',
-                'bash', '-c', f"source /usr/lib/openfoam/openfoam2412/etc/bashrc && "
-                            f"cp -r {tutorial_src}/* /target/ && "
-                            f"chmod -R 755 /target"
-            ]
-            
-            copy_process = subprocess.run(
-                copy_cmd,
-                check=True,
-                capture_output=True,
-                text=True
+            shutil.copytree(get_cached_tutorial(), run_dir, copy_function=clone_file, dirs_exist_ok=True)
+        except Exception as e:  # Docker, archive or filesystem errors
+            raise RuntimeError(f"Failed to copy tutorial files: {str(e)}") from e
+        print("✅ Copied tutorial files to run directory")
+    
+    # Long-lived container shared by every step of this run
+    container = {'id': None}
+    
+    # Function to start the run's container with the OpenFOAM environment;
+    # every docker exec in it inherits that environment. The low-level API
+    # creates and starts it without the inspect call containers.run adds.
+    def start_container():
+        api = get_docker_client().api
+        container['id'] = api.create_container(
+            get_openfoam_image().id,
+            ['sleep', 'infinity'],
+            environment=get_openfoam_env(),
+            user=RUN_USER,  # Run as current user
+            working_dir='/case',
+            hostname='openfoam-container',
+            labels={RUN_LABEL: run_id, **get_owner_labels()},
+            host_config=api.create_host_config(
+                binds={run_dir: {'bind': '/case', 'mode': CASE_MOUNT_MODE}}
             )
-            print("✅ Copied tutorial files to run directory")
-            
-            # Verify essential files were copied
-            required_files = [
-                '0/U', '0/p', 'system/controlDict',
-                'system/fvSchemes', 'system/fvSolution', 'constant/polyMesh/blockMeshDict'
-            ]
-            
-            for file in required_files:
-                if not os.path.exists(os.path.join(run_dir, file)):
-                    raise FileNotFoundError(f"Required file {file} was not copied from the tutorial")
-                    
-        except subprocess.CalledProcessError as e:
-            error_msg = f"Failed to copy tutorial files: {e.stderr}"
-            print(f"❌ {error_msg}")
-            return jsonify({
-                'status': 'error',
-                'message': error_msg
-            }), 500
-            
-        # Store process information
-        process_info = {
-            'start_time': time.time(),
-            'run_dir': run_dir,
-            'log_file': log_file,
-            'current_step': 'initializing',
-            'steps': [
-                {'name': 'blockMesh', 'status': 'pending'},
-                {'name': 'checkMesh', 'status': 'pending'},
-                {'name': 'potentialFoam', 'status': 'pending'},
-                {'name': 'simpleFoam', 'status': 'pending'},
-                {'name': 'postProcessing', 'status': 'pending'}
-            ]
-        }
+        )['Id']
+        _run_containers.add(container['id'])
+        api.start(container['id'])
+    
+    # Function to remove the run's container
+    def stop_container():
+        if container['id']:
+            _run_containers.discard(container['id'])
+            remove_container(container['id'])
+            container['id'] = None
+    
+    # Function to run a shell script in the run's container, driving step
+    # status from the STEP_MARKER lines it prints
+    def run_of_command(command):
+        # Execute the command in the run's container
+        cmd = [
+            DOCKER_CLI, 'exec',
+            container['id'],
+            'bash', '-c',
+            f'cd /case && {command}'
+        ]
         
-        # Function to update step status
-        def update_step_status(step_name, status):
-            for step in process_info['steps']:
-                if step['name'] == step_name:
-                    step['status'] = status
-                    socketio.emit('step_update', {
-                        'step': step_name,
-                        'status': status,
-                        'timestamp': time.time()
-                    })
-                    break
+        if app.debug:
+            print(f"🔧 Running command: docker exec {container['id'][:12]} [command hidden for security]")
         
-        # Function to run a single OpenFOAM command
-        def run_of_command(command, step_name=None, cwd=None):
-            if step_name:
-                update_step_status(step_name, 'running')
-                socketio.emit('output', {
-                    'data': f"\n🚀 Running {step_name}...\n",
-                    'timestamp': time.time(),
-                    'run_id': os.path.basename(run_dir)
-                })
-            
-            # Prepare the command to run in the container with correct user permissions and environment
-            cmd = [
-                'docker', 'run', '--rm',
-                '-u', f"{os.getuid()}:{os.getgid()}",  # Run as current user
-                '-v', f"{run_dir}:/case",
-                '-w', '/case',
-                # Set environment variables
-                '-e', 'FOAM_RUN=/case',
-                '-e', 'WM_PROJECT_USER_DIR=/case',
-                '-e', 'FOAM_USER_LIBBIN=/case/platforms/linux64GccDPInt32Opt/lib',
-                '-e', 'FOAM_USER_APPBIN=/case/platforms/linux64GccDPInt32Opt/bin',
-                '--hostname', 'openfoam-container',
-                'haldardhruv/ubuntu_noble_openfoam:v2412',
-                'bash', '-c', (
-                    # Initialize OpenFOAM environment
-                    'source /usr/lib/openfoam/openfoam2412/etc/bashrc && ' \
-                    # Ensure necessary directories exist
-                    'mkdir -p /case/platforms/linux64GccDPInt32Opt/{bin,lib} && ' \
-                    # Set environment variables
-                    'export FOAM_RUN=/case && ' \
-                    'export WM_PROJECT_USER_DIR=/case && ' \
-                    'export FOAM_USER_LIBBIN=/case/platforms/linux64GccDPInt32Opt/lib && ' \
-                    'export FOAM_USER_APPBIN=/case/platforms/linux64GccDPInt32Opt/bin && ' \
-                    'export LD_LIBRARY_PATH=/case/platforms/linux64GccDPInt32Opt/lib:$LD_LIBRARY_PATH && ' \
-                    'export PATH=/case/platforms/linux64GccDPInt32Opt/bin:$PATH && ' \
-                    # Run the command
-                    f'cd /case && echo "Running: {command}" && {command} || (echo "Command failed with exit code $?" && exit 1)'
-                )
-            ]
-            
-            print(f"🔧 Running command: {' '.join(cmd[:5])} [command hidden for security]")
-            
+        # Unbuffered binary pipe, since iter_output_lines reads the fd
+        # directly. An absolute executable, close_fds=False and no cwd or
+        # new session let CPython launch it with posix_spawn(); fds the
+        # app opens are non-inheritable, so none leak into the child.
+        with _proc_lock:
+            simulation = app.running_simulations[run_id]
+            # Don't start the run once a stop has been requested
+            if simulation['stop'].is_set():
+                raise RuntimeError("Simulation stopped by user")
             process = subprocess.Popen(
                 cmd,
                 stdout=subprocess.PIPE,
                 stderr=subprocess.STDOUT,
-                text=True,
-                bufsize=1,
-                universal_newlines=True,
-                cwd=cwd or run_dir
+                bufsize=0,
+                close_fds=False
             )
+            simulation['process'] = process
+        
+        # Function to handle a step progress marker
+        def handle_step_marker(line):
+            step_name, _, status = line[len(STEP_MARKER):].strip().rpartition(':')
+            update_step_status(step_name, status)
+            if status == 'running':
+                process_info['current_step'] = step_name
+                if step_name == 'postProcessing':
+                    handle_lines(["\n📊 Running post-processing...\n"])
+                else:
+                    handle_lines([f"\n🚀 Running {step_name}...\n"])
+        
+        # Function to log a chunk of lines and queue it for clients
+        def handle_lines(lines):
+            if lines:
+                log_f.write(('\n'.join(lines) + '\n').encode('utf-8'))
+                batcher.add_lines(lines)
+        
+        # Stream output in real-time as coalesced batches, appending it to
+        # the run log with one buffered write per chunk
+        with open(log_file, 'ab', buffering=LOG_BUFFER_SIZE) as log_f:
+            batcher = LineBatcher(run_id, on_flush=log_f.flush)
+            try:
+                for lines in iter_output_lines(process):
+                    output = []
+                    for line in lines:
+                        if line.startswith(STEP_MARKER):
+                            # Keep the step banner in order with the output around it
+                            handle_lines(output)
+                            output = []
+                            handle_step_marker(line)
+                        elif line.strip():
+                            output.append(line)
+                    handle_lines(output)
+            finally:
+                batcher.close()
+        
+        # Wait for process to complete
+        return_code = process.wait()
+        with _proc_lock:
+            simulation['return_code'] = return_code
+        
+        if return_code != 0:
+            raise subprocess.CalledProcessError(return_code, process_info['current_step'])
+        
+        return True
+    
+    # Function to build the script that runs every step in one docker exec
+    def build_run_script():
+        def step(name, command, required=True):
+            # Print a marker before and after the step; a required step
+            # that fails ends the script with its exit code
+            script = (
+                f"echo '{STEP_MARKER}{name}:running'\n"
+                f"if {command}; then echo '{STEP_MARKER}{name}:completed'; "
+                f"else rc=$?; echo '{STEP_MARKER}{name}:failed'; echo \"Command failed with exit code $rc\"; "
+            )
+            if required:
+                script += "exit $rc; "
+            return script + "fi\n"
+        
+        # Post-processing tools are best effort, as before
+        post_processing = "{ "
+        if os.path.exists(os.path.join(run_dir, 'system/sampleDict')):
+            post_processing += "sample -dict system/sampleDict; "
+        post_processing += "postProcess -func 'mag(U)'; true; }"
+        
+        return (
+            # Ensure the user platform directories exist
+            f"mkdir -p {OPENFOAM_USER_PLATFORM}/bin {OPENFOAM_USER_PLATFORM}/lib\n" +
+            step('blockMesh', 'blockMesh') +
+            step('checkMesh', 'checkMesh', required=False) +  # checkMesh can fail but continue
+            step('potentialFoam', 'potentialFoam') +
+            step('simpleFoam', 'simpleFoam') +
+            step('postProcessing', post_processing)
+        )
+    
+    # Start a thread to run the simulation
+    def run_simulation_thread():
+        status = 'failed'
+        try:
+            copy_tutorial()
+            start_container()
             
-            # Read output in real-time
-            for line in process.stdout:
-                if line.strip():
-                    socketio.emit('output', {
-                        'data': line.rstrip('\n'),
-                        'timestamp': time.time(),
-                        'run_id': os.path.basename(run_dir)
-                    })
-            
-            # Wait for process to complete
-            return_code = process.wait()
+            # Run every step through a single docker exec
+            run_of_command(build_run_script())
             
-            if step_name:
-                status = 'completed' if return_code == 0 else 'failed'
-                update_step_status(step_name, status)
-                
-                if return_code != 0 and step_name != 'checkMesh':  # checkMesh can have non-zero exit but continue
-                    raise subprocess.CalledProcessError(return_code, cmd)
+            socketio.emit('output', {
+                'data': "\n✅ Simulation completed successfully!\n",
+                'timestamp': time.time(),
+                'run_id': run_id
+            }, to=run_id)
+            status = 'completed'
             
-            return return_code == 0
-        
-        # Start a thread to run the simulation
-        def run_simulation_thread():
-            # Use the global current_process variable
-            global current_process
-            try:
-                # Run blockMesh
-                if not run_of_command('blockMesh', 'blockMesh'):
-                    raise Exception("blockMesh failed")
-                
-                # Run checkMesh (continue even if it fails)
-                try:
-                    run_of_command('checkMesh', 'checkMesh')
-                except:
-                    pass  # Continue even if checkMesh fails
-                
-                # Run potentialFoam
-                if not run_of_command('potentialFoam', 'potentialFoam'):
-                    raise Exception("potentialFoam failed")
-                
-                # Run simpleFoam
-                if not run_of_command('simpleFoam', 'simpleFoam'):
-                    raise Exception("simpleFoam failed")
-                
-                # Run post-processing
-                update_step_status('postProcessing', 'running')
-                socketio.emit('output', {
-                    'data': "\n📊 Running post-processing...\n",
-                    'timestamp': time.time(),
-                    'run_id': os.path.basename(run_dir)
-                })
-                
-                # Run sample if sampleDict exists
-                if os.path.exists(os.path.join(run_dir, 'system/sampleDict')):
-                    run_of_command('sample -dict system/sampleDict')
-                
-                # Run postProcess for basic field data
-                run_of_command('postProcess -func \'mag(U)\'')
-                
-                update_step_status('postProcessing', 'completed')
-                
+        except Exception as e:
+            with _proc_lock:
+                stopped = app.running_simulations[run_id]['stop'].is_set()
+            if stopped:
+                # The step was killed on request, not a failure
                 socketio.emit('output', {
-                    'data': "\n✅ Simulation completed successfully!\n",
+                    'data': "\n⏹️ Simulation stopped\n",
                     'timestamp': time.time(),
-                    'run_id': os.path.basename(run_dir)
-                })
-                
-            except Exception as e:
+                    'run_id': run_id
+                }, to=run_id)
+            else:
                 socketio.emit('error', {
                     'message': f"Simulation failed: {str(e)}",
                     'timestamp': time.time(),
-                    'run_id': os.path.basename(run_dir)
-                })
+                    'run_id': run_id
+                }, to=run_id)
                 app.logger.error(f"Simulation failed: {str(e)}", exc_info=True)
-            finally:
-                current_process = None
-        
-        # Create a thread to run the simulation
-        import threading
-        thread = threading.Thread(target=run_simulation_thread)
-        thread.daemon = True
-        
-        try:
-            # Start the simulation thread
-            thread.start()
+        finally:
+            stop_container()
+            with _proc_lock:
+                simulation = app.running_simulations[run_id]
+                simulation['process'] = None
+                simulation['status'] = 'stopped' if simulation['stop'].is_set() else status
+                return_code = simulation['return_code']
             
-            # Create a response with simulation details
-            response = {
-                'status': 'started',
-                'run_id': os.path.basename(run_dir),
-                'message': f'Simulation started in directory: {run_dir}',
-                'log_file': os.path.join(run_dir, 'simulation.log'),
-                'start_time': time.strftime('%Y-%m-%d %H:%M:%S')
+            if status == 'completed':
+                exit_code = 0
+            else:
+                exit_code = return_code if return_code else 1
+            complete = {
+                'run_id': run_id,
+                'exit_code': exit_code,
+                'duration': (time.monotonic_ns() - process_info['start_monotonic']) / 1e9,
+                'log_file': log_file
             }
+            # Kept so clients that join the room later still learn the outcome
+            with _proc_lock:
+                simulation['complete'] = complete
+            socketio.emit('simulation_complete', complete, to=run_id)
             
-            # Store simulation info for later reference
-            if not hasattr(app, 'running_simulations'):
-                app.running_simulations = {}
-            app.running_simulations[os.path.basename(run_dir)] = {
-                'thread': thread,
+            # Append the run summary once clients have been notified
+            end_time = time.time()
+            summary = (
+                "\n" + "=" * 80 + "\n"
+                f"Process completed with exit code: {exit_code}\n"
+                f"Start time: {time.ctime(process_info['start_time'])}\n"
+                f"End time: {time.ctime(end_time)}\n"
+                f"Duration: {complete['duration']:.2f} seconds\n"
+            )
+            try:
+                with open(log_file, 'ab') as log_f:
+                    log_f.write(summary.encode('utf-8'))
+            except OSError as e:
+                print(f"❌ Error writing log summary: {str(e)}", file=sys.stderr)
+    
+    try:
+        # Create a response with simulation details
+        response = {
+            'status': 'started',
+            'run_id': run_id,
+            'message': f'Simulation started in directory: {run_dir}',
+            'log_file': os.path.join(run_dir, 'simulation.log'),
+            'start_time': time.strftime('%Y-%m-%d %H:%M:%S')
+        }
+        
+        # Start the simulation on a simulation worker and store its info
+        # for later reference; the run thread can't look it up until
+        # _proc_lock is released. The requesting client joins the run's
+        # room first so it gets every event, even from a run that fails
+        # before the response arrives.
+        with _proc_lock:
+            if sid and socketio.server.manager.is_connected(sid, '/'):
+                subscribe_to_run(sid, run_id)
+            future = SIM_EXECUTOR.submit(run_simulation_thread)
+            app.running_simulations[run_id] = {
+                'future': future,  # Done once every step has finished
                 'start_time': time.time(),
                 'status': 'running',
-                'log_file': response['log_file']
+                'log_file': response['log_file'],
+                'process': None,  # Popen of the step currently executing
+                'return_code': None,  # Exit code of the last finished step
+                'stop': threading.Event(),
+                'complete': None  # simulation_complete payload once finished
             }
-            
-            return jsonify(response)
-            
-        except Exception as e:
-            error_msg = f"Failed to start simulation thread: {str(e)}"
-            print(f"❌ {error_msg}")
-            return jsonify({
-                'status': 'error',
-                'message': error_msg
-            }), 500
+            # Forget the oldest finished runs past the recent-output cap
+            finished = [rid for rid, sim in app.running_simulations.items() if sim['future'].done()]
+            excess = len(app.running_simulations) - RECENT_OUTPUT_RUNS
+            for old_id in finished[:max(excess, 0)]:
+                del app.running_simulations[old_id]
+        
+        return jsonify(response)
+        
+    except Exception as e:
+        error_msg = f"Failed to start simulation thread: {str(e)}"
+        print(f"❌ {error_msg}")
+        return jsonify({
+            'status': 'error',
+            'message': error_msg
+        }), 500
 
 @app.route('/api/stop_simulation', methods=['POST'])
 def stop_simulation():
-    global current_process
+    data = request.get_json(silent=True) or {}
     
-    if current_process is None or current_process.poll() is not None:
-        return jsonify({'status': 'error', 'message': 'No simulation is currently running'}), 400
+    with _proc_lock:
+        simulation = _find_simulation(data.get('run_id'))
+        if simulation is None or simulation['future'].done():
+            return jsonify({'status': 'error', 'message': 'No simulation is currently running'}), 400
+        # Keep the run thread from starting any further steps
+        simulation['stop'].set()
+        process = simulation['process']
+    
+    if process is None:
+        # Between steps; the run thread will notice the stop request
+        return jsonify({'status': 'success', 'message': 'Simulation stopped'})
     
     try:
-        # Terminate the process group
-        os.killpg(os.getpgid(current_process.pid), 9)
-        current_process = None
+        terminate_process(process)
         return jsonify({'status': 'success', 'message': 'Simulation stopped'})
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
+def cached_status(name, ttl, compute):
+    """Return compute()'s result, reusing it for ttl seconds."""
+    now = time.monotonic()
+    entry = _status_cache.get(name)
+    if entry is None or entry[0] <= now:
+        entry = (now + ttl, compute())
+        _status_cache[name] = entry
+    return entry[1]
+
 @app.route('/api/check_docker', methods=['GET'])
 def check_docker():
     """Check if Docker is running and return its status."""
-    try:
-        client = docker.from_env()
-        client.ping()
-        return jsonify({
-            'status': 'success',
-            'running': True,
-            'version': client.version()['Version']
-        })
-    except Exception as e:
-        return jsonify({
-            'status': 'success',  # Still success because we got a response
-            'running': False,
-            'error': str(e)
-        })
+    # Function to query the daemon; version() fails too if it isn't reachable
+    def query_docker():
+        try:
+            return {
+                'status': 'success',
+                'running': True,
+                'version': get_docker_client().version()['Version']
+            }
+        except Exception as e:
+            return {
+                'status': 'success',  # Still success because we got a response
+                'running': False,
+                'error': str(e)
+            }
+    
+    # Cache the encoded body so polls within the TTL skip serialization too
+    body = cached_status('docker', DOCKER_STATUS_TTL, lambda: orjson.dumps(query_docker()))
+    return app.response_class(body, mimetype='application/json')
 
 @app.route('/api/check_disk_space', methods=['GET'])
 def check_disk_space():
     """Check available disk space and return in GB."""
     try:
         # Get disk usage statistics for the root partition
-        disk_usage = psutil.disk_usage('/')
+        disk_usage = cached_status('disk', DISK_USAGE_TTL, lambda: load_psutil().disk_usage('/'))
         
-        # Convert bytes to GB
-        total_gb = disk_usage.total / (1024 ** 3)
-        used_gb = disk_usage.used / (1024 ** 3)
-        free_gb = disk_usage.free / (1024 ** 3)
-        percent_used = disk_usage.percent
+        # Convert bytes to GB; free space is reported under both names
+        free_gb = round(disk_usage.free * INV_GIB, 2)
         
         return jsonify({
             'status': 'success',
-            'total_gb': round(total_gb, 2),
-            'used_gb': round(used_gb, 2),
-            'free_gb': round(free_gb, 2),
-            'available_gb': round(disk_usage.free / (1024 ** 3), 2),
-            'percent_used': round(percent_used, 2)
+            'total_gb': round(disk_usage.total * INV_GIB, 2),
+            'used_gb': round(disk_usage.used * INV_GIB, 2),
+            'free_gb': free_gb,
+            'available_gb': free_gb,
+            'percent_used': disk_usage.percent  # psutil already rounds this
         })
     except Exception as e:
         return jsonify({
@@ -482,145 +978,241 @@ def check_disk_space():
             'message': str(e)
         }), 500
 
+# Pre-encoded bodies for the fixed-shape status responses
+_NOT_RUNNING_JSON = orjson.dumps({'status': 'not_running'})
+_RUNNING_JSON = orjson.dumps({'status': 'running'})
+
 @app.route('/api/simulation_status', methods=['GET'])
 def simulation_status():
-    global current_process
+    with _proc_lock:
+        simulation = _find_simulation(request.args.get('run_id'))
+    
+    if simulation is None:
+        return app.response_class(_NOT_RUNNING_JSON, mimetype='application/json')
     
-    if current_process is None:
-        return jsonify({'status': 'not_running'})
+    # The run's future completes once every step has finished
+    if not simulation['future'].done():
+        return app.response_class(_RUNNING_JSON, mimetype='application/json')
     
-    return_code = current_process.poll()
-    if return_code is None:
-        return jsonify({'status': 'running'})
-    else:
-        return jsonify({'status': 'completed', 'return_code': return_code})
+    # A finished run's status never changes, so encode it once
+    body = simulation.get('status_json')
+    if body is None:
+        body = simulation['status_json'] = orjson.dumps({
+            'status': 'completed',
+            'return_code': simulation['return_code'],
+            'result': simulation['status']
+        })
+    return app.response_class(body, mimetype='application/json')
 
-def read_process_output(process, log_file, process_info):
-    """Read process output and send it via WebSocket
+@app.route('/api/logs/<run_id>', methods=['GET'])
+def get_run_log(run_id):
+    """Return a run's log from ?offset= onwards, streamed from disk."""
+    # Run ids name directories under RUNS_ROOT and are never paths
+    if os.path.basename(run_id) != run_id or run_id in ('.', '..'):
+        return jsonify({'status': 'error', 'message': 'Invalid run id'}), 400
     
-    Args:
-        process: The subprocess.Popen object
-        log_file: Path to the log file
-        process_info: Dictionary containing process information
-    """
-    log_f = None
     try:
-        # Ensure log directory exists
-        log_dir = os.path.dirname(log_file)
-        if not os.path.exists(log_dir):
-            os.makedirs(log_dir, exist_ok=True, mode=0o755)
-            
-        # Open log file in append mode
-        log_f = open(log_file, 'a', buffering=1)  # Line buffered
-        
-        # Function to handle output line
-        def handle_output(line):
-            if not line or not line.strip():
+        log_f = open(os.path.join(RUNS_ROOT, run_id, 'simulation.log'), 'rb')
+    except FileNotFoundError:
+        return jsonify({'status': 'error', 'message': 'Log not found'}), 404
+    
+    offset = request.args.get('offset', 0, type=int)
+    if offset > 0:
+        log_f.seek(offset)
+    
+    # Hand the open file to the server's file wrapper, which can send it
+    # with sendfile() instead of reading it through Python. The log grows
+    # while a run is live, so keep proxies from caching or buffering it.
+    return app.response_class(
+        wrap_file(request.environ, log_f),
+        mimetype='text/plain',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+        direct_passthrough=True
+    )
+
+@app.route('/api/recent_output', methods=['GET'])
+def get_recent_output():
+    """Return a run's most recent output lines, newest last.
+    
+    ?run_id= picks the run; without it the latest run with output is used.
+    """
+    limit = request.args.get('lines', RECENT_OUTPUT_SIZE, type=int)
+    run_id = request.args.get('run_id')
+    with _output_lock:
+        if not run_id and recent_output:
+            run_id = next(reversed(recent_output))
+        lines = list(recent_output.get(run_id, ()))
+    if limit < len(lines):
+        lines = lines[len(lines) - max(limit, 0):]
+    return jsonify({
+        'status': 'success',
+        'run_id': run_id,
+        'lines': lines
+    })
+
+class LineBatcher:
+    """Streams output lines of a run to clients as output_batch events
+    
+    Each chunk of lines from the reader is queued as one item and emitted
+    by a background task every OUTPUT_BATCH_LINES lines or
+    OUTPUT_BATCH_INTERVAL seconds, whichever comes first, with runs of
+    identical lines collapsed into one counted entry. A full queue makes the
+    reader wait; only if the emitter stays stalled for OUTPUT_STALL_TIMEOUT
+    is the oldest chunk dropped.
+    """
+    
+    def __init__(self, run_id, on_flush=None):
+        self.run_id = run_id
+        self.on_flush = on_flush
+        self._queue = queue.Queue(maxsize=OUTPUT_QUEUE_SIZE)
+        self._task = socketio.start_background_task(self._emit_loop)
+    
+    def add_lines(self, lines):
+        """Queue a chunk of lines, stamped with a single timestamp."""
+        timestamp = time.time()
+        with _output_lock:
+            tail = recent_output.get(self.run_id)
+            if tail is None:
+                tail = recent_output[self.run_id] = deque(maxlen=RECENT_OUTPUT_SIZE)
+                while len(recent_output) > RECENT_OUTPUT_RUNS:
+                    del recent_output[next(iter(recent_output))]
+            tail.extend({'data': line, 'timestamp': timestamp} for line in lines)
+        self._put((timestamp, lines))
+    
+    def close(self):
+        """Flush any queued lines and stop the emitter task."""
+        self._put(None)
+        self._task.join()
+    
+    def _put(self, item):
+        try:
+            self._queue.put(item, timeout=OUTPUT_STALL_TIMEOUT)
+            return
+        except queue.Full:
+            pass
+        # The emitter is stalled; make room by dropping the oldest chunk
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                pass
+            try:
+                self._queue.put_nowait(item)
                 return
-                
-            # Clean up the line
-            line = line.rstrip('\n')
-            
-            # Log to file
-            log_f.write(line + '\n')
-            
-            # Send to WebSocket
+            except queue.Full:
+                pass
+    
+    def _send(self, buf, timestamp):
+        # Send to the run's room without a callback so python-socketio
+        # encodes the packet once and reuses it for every subscriber. A lone
+        # line goes out as a plain output event; batches carry one timestamp
+        # and send repeated lines as [text, count]
+        if len(buf) == 1 and buf[0][1] == 1:
             socketio.emit('output', {
-                'data': line,
-                'timestamp': time.time(),
-                'run_id': os.path.basename(process_info['run_dir'])
-            })
-            
-            # Print to console for debugging
-            print(f"[PROCESS OUTPUT] {line}")
-        
-        # Read output line by line
-        for line in iter(process.stdout.readline, ''):
-            handle_output(line)
-        
-        # Read any remaining output
-        for line in process.stdout:
-            handle_output(line)
-            
-        # Wait for process to complete
-        return_code = process.wait()
-        
-        # Log process completion
-        completion_msg = (
-            "\n✅ Process completed successfully\n" if return_code == 0 
-            else f"\n❌ Process failed with return code {return_code}\n"
-        )
-        
-        handle_output(completion_msg)
-        return return_code
-        
-    except Exception as e:
-        error_msg = f"Error reading process output: {str(e)}"
-        print(f"❌ {error_msg}", file=sys.stderr)
-        
-        try:
-            socketio.emit('error', {
-                'message': error_msg,
-                'timestamp': time.time(),
-                'run_id': os.path.basename(process_info.get('run_dir', 'unknown'))
-            })
-        except Exception as emit_error:
-            print(f"❌ Failed to emit error: {str(emit_error)}", file=sys.stderr)
-        
-        if log_f:
-            log_f.write(f"\n❌ {error_msg}\n")
-        
-        return 1
-            
-    finally:
-        # Clean up when process is done
-        if 'process' in locals() and process:
-            process_info['end_time'] = time.time()
-            process_info['exit_code'] = process.poll()
-            
-            # Log completion
+                'data': buf[0][0],
+                'timestamp': timestamp,
+                'run_id': self.run_id
+            }, to=self.run_id, namespace='/')
+        else:
+            socketio.emit('output_batch', {
+                'run_id': self.run_id,
+                'timestamp': timestamp,
+                'lines': [text if count == 1 else [text, count] for text, count in buf]
+            }, to=self.run_id, namespace='/')
+        if self.on_flush:
+            self.on_flush()
+    
+    def _emit_loop(self):
+        # Pending lines as [text, count] pairs, stamped with the first one's time
+        buf = []
+        timestamp = None
+        last_flush = time.monotonic()
+        done = False
+        while not done:
             try:
-                if log_f is None:  # If we never opened the file, try to open it now
-                    log_f = open(log_file, 'a')
-                
-                # Write completion message
-                log_f.write("\n" + "=" * 80 + "\n")
-                log_f.write(f"Process completed with exit code: {process_info.get('exit_code', -1)}\n")
-                
-                # Write process timing information
-                if 'start_time' in process_info and 'end_time' in process_info:
-                    log_f.write(f"Start time: {time.ctime(process_info['start_time'])}\n")
-                    log_f.write(f"End time: {time.ctime(process_info['end_time'])}\n")
-                    duration = process_info['end_time'] - process_info['start_time']
-                    log_f.write(f"Duration: {duration:.2f} seconds\n")
-                
-            except Exception as log_error:
-                print(f"❌ Error writing to log file: {str(log_error)}", file=sys.stderr)
+                item = self._queue.get(timeout=OUTPUT_BATCH_INTERVAL)
+            except queue.Empty:
+                item = False
             
-            finally:
-                if 'log_f' in locals() and log_f is not None:
-                    try:
-                        log_f.flush()
-                        os.fsync(log_f.fileno())
-                        log_f.close()
-                    except Exception as close_error:
-                        print(f"❌ Error closing log file: {str(close_error)}", file=sys.stderr)
-        
-        # Calculate duration if we have both start and end times
-        duration = 0
-        if 'start_time' in process_info and 'end_time' in process_info:
-            duration = process_info['end_time'] - process_info['start_time']
+            if item is None:
+                done = True
+            elif item:
+                chunk_timestamp, lines = item
+                for line in lines:
+                    # Collapse runs of identical lines into one counted entry
+                    if buf and buf[-1][0] == line:
+                        buf[-1][1] += 1
+                        continue
+                    if len(buf) >= OUTPUT_BATCH_LINES:
+                        self._send(buf, timestamp)
+                        buf = []
+                        last_flush = time.monotonic()
+                    if not buf:
+                        timestamp = chunk_timestamp
+                    buf.append([line, 1])
             
-        # Notify clients
+            now = time.monotonic()
+            if buf and (done or len(buf) >= OUTPUT_BATCH_LINES
+                        or now - last_flush > OUTPUT_BATCH_INTERVAL):
+                self._send(buf, timestamp)
+                buf = []
+                last_flush = now
+
+def iter_output_lines(process):
+    """Yield lists of output lines from the process's stdout as they arrive
+    
+    Output is read in large chunks and split into lines, carrying any
+    incomplete trailing line over to the next read. On Linux the process
+    exit is watched through a pidfd in the same selector, so reading stops
+    as soon as the process exits and its remaining output is drained.
+    """
+    fd = process.stdout.fileno()
+    os.set_blocking(fd, False)
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    tail = ''
+    
+    sel = selectors.DefaultSelector()
+    sel.register(fd, selectors.EVENT_READ, 'out')
+    pidfd = None
+    if hasattr(os, 'pidfd_open'):
         try:
-            socketio.emit('simulation_complete', {
-                'run_id': os.path.basename(process_info['run_dir']),
-                'exit_code': process_info.get('exit_code', -1),
-                'duration': duration,
-                'log_file': log_file
-            })
-        except Exception as e:
-            app.logger.error(f"Failed to send simulation complete event: {str(e)}")
+            pidfd = os.pidfd_open(process.pid)
+            sel.register(pidfd, selectors.EVENT_READ, 'exit')
+        except OSError:
+            pidfd = None
+    
+    try:
+        done = False
+        while not done:
+            for key, _ in sel.select():
+                # After exit, drain what is left in the pipe without waiting for EOF
+                exited = key.data == 'exit'
+                while True:
+                    try:
+                        data = os.read(fd, OUTPUT_READ_SIZE)
+                    except BlockingIOError:
+                        break
+                    if not data:
+                        done = True
+                        break
+                    lines = (tail + decoder.decode(data)).split('\n')
+                    tail = lines.pop()
+                    if lines:
+                        yield lines
+                    if not exited:
+                        break
+                if exited:
+                    done = True
+                if done:
+                    break
+    finally:
+        sel.close()
+        if pidfd is not None:
+            os.close(pidfd)
+    
+    tail += decoder.decode(b'', final=True)
+    if tail:
+        yield [tail]
 
 @socketio.on('connect')
 def handle_connect():
@@ -630,11 +1222,39 @@ def handle_connect():
 def handle_disconnect():
     print('Client disconnected')
 
+def subscribe_to_run(sid, run_id):
+    """Move a client into a run's room, leaving any previous run's room"""
+    for room in rooms(sid=sid, namespace='/'):
+        if room != sid:
+            leave_room(room, sid=sid, namespace='/')
+    join_room(run_id, sid=sid, namespace='/')
+
+@socketio.on('join_run')
+def handle_join_run(data):
+    """Subscribe the client to one run's events, leaving any previous run
+    
+    If the run has already finished, its simulation_complete event is sent
+    again to this client, since it was emitted before the client joined.
+    """
+    run_id = (data or {}).get('run_id')
+    if not run_id:
+        return
+    subscribe_to_run(request.sid, run_id)
+    with _proc_lock:
+        simulation = app.running_simulations.get(run_id)
+        complete = simulation and simulation['complete']
+    if complete:
+        emit('simulation_complete', complete)
+
 if __name__ == '__main__':
     # Create necessary directories
     os.makedirs('templates', exist_ok=True)
     os.makedirs('static/css', exist_ok=True)
     os.makedirs('static/js', exist_ok=True)
     
-    # Run the app
-    socketio.run(app, debug=True, host='0.0.0.0', port=5000)
+    start_warm_up()
+    
+    # Run the app; debug mode is opt-in and never uses the reloader, which
+    # would start a second interpreter and poll every module for changes
+    debug = os.environ.get('FOAMCHALAK_DEBUG') == '1'
+    socketio.run(app, debug=debug, use_reloader=False, host='0.0.0.0', port=5000)
@@ -1,6 +1,8 @@
 import docker
+from docker.utils.socket import frames_iter, STDERR
 import os
 import sys
+import codecs
 
 def run_openfoam(
     image: str = "haldardhruv/ubuntu_noble_openfoam:v12",
@@ -43,22 +45,39 @@ def run_openfoam(
             image,
             command,
             detach=True,
-            tty=True,
+            tty=False,
             stdout=True,
             stderr=True,
             volumes={case_dir: {"bind": container_case_path, "mode": "rw"}}
         )
 
-        # Wait for completion and capture logs
+        # Read the attach socket directly and demultiplex stdout/stderr
+        # frames as they arrive; logs=1 replays anything already written
+        sock = container.attach_socket(
+            params={"stdout": 1, "stderr": 1, "stream": 1, "logs": 1}
+        )
+        decoders = {
+            out: codecs.getincrementaldecoder("utf-8")(errors="replace")
+            for out in (sys.stdout, sys.stderr)
+        }
+        try:
+            for stream, payload in frames_iter(sock, tty=False):
+                out = sys.stderr if stream == STDERR else sys.stdout
+                out.write(decoders[out].decode(payload))
+                out.flush()
+        finally:
+            sock.close()
+        for out, decoder in decoders.items():
+            out.write(decoder.decode(b"", final=True))
+            out.flush()
+
+        # The stream ends when the container exits; collect its status
         result = container.wait()
-        logs = container.logs().decode()
 
         if result["StatusCode"] == 0:
             print("✅ Solver finished successfully")
-            print(logs)
         else:
-            print("❌ Solver failed")
-            print(logs, file=sys.stderr)
+            print("❌ Solver failed", file=sys.stderr)
 
     except docker.errors.ImageNotFound:
         print(f"❌ Docker image not found: {image}", file=sys.stderr)
@@ -67,11 +86,8 @@ def run_openfoam(
     finally:
         if container:
             try:
-                container.kill()     # kill if still running
-            except Exception:
-                pass
-            try:
-                container.remove()   # always remove
+                # One call: force also kills a container left running by an error
+                container.remove(force=True)
             except Exception:
                 pass
 
@@ -4,6 +4,13 @@ import time
 import docker
 import shutil
 import logging
+import atexit
+import codecs
+import io
+import tarfile
+import platform
+import socket
+import psutil
 
 # Set up logging
 logging.basicConfig(
@@ -20,6 +27,20 @@ import tempfile
 import glob
 from typing import Optional, Union, List
 
+# Paths resolved once at import
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+RUNS_DIR = os.path.join(SCRIPT_DIR, 'runs')
+LOCAL_TUTORIAL_DIR = os.path.join(SCRIPT_DIR, 'tutorials', 'pitzDaily')
+
+# Where the case directory is mounted inside the worker container
+CONTAINER_CASE_PATH = "/home/foam/case"
+
+# pitzDaily tutorial inside the OpenFOAM image
+TUTORIAL_SRC = "/usr/lib/openfoam/openfoam2412/tutorials/incompressible/simpleFoam/pitzDaily"
+
+# Relax bind-mount consistency on Docker Desktop, where host file sharing is slow
+CASE_MOUNT_MODE = "rw,delegated" if platform.system() in ("Darwin", "Windows") else "rw"
+
 def check_disk_space(min_space_gb: float = 5.0) -> bool:
     """Check if there's enough disk space for Docker image"""
     try:
@@ -71,8 +92,14 @@ def pull_docker_image(image_name: str) -> bool:
             print(f"❌ Failed to pull image: {e}")
             return False
 
+# OpenFOAM bashrc location per image, found once per process
+_bashrc_cache = {}
+
 def find_openfoam_bashrc(image_name: str) -> str:
     """Find OpenFOAM bashrc in Docker image"""
+    if image_name in _bashrc_cache:
+        return _bashrc_cache[image_name]
+    
     client = docker.from_env()
     common_paths = [
         "/usr/lib/openfoam/openfoam2412/etc/bashrc",
@@ -81,63 +108,109 @@ def find_openfoam_bashrc(image_name: str) -> str:
         "/usr/lib64/openfoam/openfoam2412/etc/bashrc",
     ]
     
-    for path in common_paths:
-        try:
-            result = client.containers.run(
-                image_name,
-                f"bash -c '[ -f {path} ] && echo FOUND || echo NOT_FOUND'",
-                remove=True,
-                stdout=True,
-                stderr=True
-            )
-            if b"FOUND" in result:
-                print(f"✅ Found OpenFOAM bashrc at: {path}")
-                return path
-        except Exception as e:
-            continue
+    # Probe every candidate in a single container and print the first hit
+    probe = "for p in " + " ".join(common_paths) + "; do [ -f \"$p\" ] && echo \"$p\" && break; done"
+    try:
+        result = client.containers.run(
+            image_name,
+            ["bash", "-c", probe],
+            remove=True,
+            stdout=True,
+            stderr=True
+        )
+        path = result.decode('utf-8', errors='replace').strip()
+        if path in common_paths:
+            print(f"✅ Found OpenFOAM bashrc at: {path}")
+            _bashrc_cache[image_name] = path
+            return path
+    except Exception:
+        pass
     
     print("❌ Could not find OpenFOAM bashrc")
     return ""
 
-def run_openfoam_command(
-    image: str,
-    command: str,
-    case_dir: str,
-    bashrc_path: str = ""
-) -> bool:
-    """Run an OpenFOAM command in a Docker container"""
-    if not pull_docker_image(image):
+# Worker containers kept alive between commands, keyed by (image, case_dir)
+_workers = {}
+
+# Workers are labelled with the owning process so ones left behind by a
+# killed run of this script can be found and removed. Pids are per host and
+# get reused, so the owner is its hostname, pid and process start time.
+WORKER_LABEL = "foamchalak.worker"
+WORKER_HOST_LABEL = "foamchalak.worker.host"
+WORKER_PID_LABEL = "foamchalak.worker.pid"
+WORKER_STARTED_LABEL = "foamchalak.worker.started"
+_stale_workers_checked = False
+
+def _owner_labels() -> dict:
+    """Labels identifying this process as a worker's owner"""
+    return {
+        WORKER_LABEL: "1",
+        WORKER_HOST_LABEL: socket.gethostname(),
+        WORKER_PID_LABEL: str(os.getpid()),
+        WORKER_STARTED_LABEL: repr(psutil.Process().create_time())
+    }
+
+def _owner_dead(labels: dict) -> bool:
+    """Check whether a worker's owner on this host has exited"""
+    if labels.get(WORKER_HOST_LABEL) != socket.gethostname():
+        return False
+    try:
+        pid = int(labels[WORKER_PID_LABEL])
+        started = float(labels[WORKER_STARTED_LABEL])
+    except (KeyError, ValueError):
         return False
+    try:
+        # A pid now held by a process started at another time was reused
+        return abs(psutil.Process(pid).create_time() - started) >= 1.0
+    except psutil.NoSuchProcess:
+        return True
+
+def _remove_stale_workers(client):
+    """Remove worker containers whose owning process is gone"""
+    for container in client.containers.list(all=True, filters={"label": WORKER_LABEL}):
+        if not _owner_dead(container.labels):
+            continue
+        print(f"🧹 Removing stale worker container {container.short_id}")
+        try:
+            container.remove(force=True)
+        except Exception:
+            pass
+
+def _remove_workers():
+    """Stop and remove all worker containers and their temp homes"""
+    for container, temp_home in _workers.values():
+        try:
+            container.remove(force=True)
+        except Exception:
+            pass
+        shutil.rmtree(temp_home, ignore_errors=True)
+    _workers.clear()
+
+atexit.register(_remove_workers)
+
+def get_worker_container(image: str, case_dir: str):
+    """Return a running worker container for the case, starting one if needed"""
+    global _stale_workers_checked
+    key = (image, os.path.abspath(case_dir))
+    if key in _workers:
+        return _workers[key][0]
     
-    if not bashrc_path:
-        bashrc_path = find_openfoam_bashrc(image)
-        if not bashrc_path:
-            return False
+    if not pull_docker_image(image):
+        return None
     
     client = docker.from_env()
-    container_case_path = "/home/foam/case"
+    if not _stale_workers_checked:
+        _stale_workers_checked = True
+        _remove_stale_workers(client)
     
+    temp_home = tempfile.mkdtemp(prefix='foam_home_')
+    os.chmod(temp_home, 0o755)
     try:
-        # Create temp directory
-        temp_home = tempfile.mkdtemp(prefix='foam_home_')
-        os.chmod(temp_home, 0o755)
-        
-        # Use a much simpler command approach
-        full_command = f"""
-        . {bashrc_path} && \
-        cd {container_case_path} && \
-        {command}
-        """
-        
-        print(f"🚀 Running: {command}")
-        print(f"📂 Case: {case_dir}")
-        
-        # Run container with simple command
-        result = client.containers.run(
+        container = client.containers.run(
             image,
-            command=["/bin/bash", "-c", full_command],
+            command=["sleep", "infinity"],
             volumes={
-                os.path.abspath(case_dir): {"bind": container_case_path, "mode": "rw"},
+                key[1]: {"bind": CONTAINER_CASE_PATH, "mode": CASE_MOUNT_MODE},
                 temp_home: {"bind": "/home/foam", "mode": "rw"}
             },
             environment={
@@ -148,40 +221,70 @@ def run_openfoam_command(
                 "HOME": "/home/foam",
                 "USER": "foam"
             },
-            working_dir=container_case_path,
+            working_dir=CONTAINER_CASE_PATH,
             mem_limit='4g',
             memswap_limit='4g',
             user=f"{os.getuid()}:{os.getgid()}",
-            remove=True,
-            stdout=True,
-            stderr=True
+            labels=_owner_labels(),
+            detach=True
         )
+    except Exception:
+        shutil.rmtree(temp_home, ignore_errors=True)
+        raise
+    
+    _workers[key] = (container, temp_home)
+    return container
+
+def run_openfoam_command(
+    image: str,
+    command: str,
+    case_dir: str,
+    bashrc_path: str = ""
+) -> bool:
+    """Run an OpenFOAM command in the case's worker container"""
+    if not bashrc_path:
+        bashrc_path = find_openfoam_bashrc(image)
+        if not bashrc_path:
+            return False
+    
+    try:
+        container = get_worker_container(image, case_dir)
+        if container is None:
+            return False
+        
+        # Use a much simpler command approach
+        full_command = f"""
+        . {bashrc_path} && \
+        cd {CONTAINER_CASE_PATH} && \
+        {command}
+        """
+        
+        print(f"🚀 Running: {command}")
+        print(f"📂 Case: {case_dir}")
         
-        # Print output
-        output = result.decode('utf-8', errors='replace')
+        # Exec the command in the already running container, streaming its
+        # output as it arrives rather than buffering it until the exit
+        api = container.client.api
+        exec_id = api.exec_create(container.id, ["/bin/bash", "-c", full_command])["Id"]
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
         print("=== Command Output ===")
-        print(output)
-        print("======================")
+        for chunk in api.exec_start(exec_id, stream=True):
+            sys.stdout.write(decoder.decode(chunk))
+        sys.stdout.write(decoder.decode(b"", final=True))
+        print("\n======================")
+        exit_code = api.exec_inspect(exec_id)["ExitCode"]
+        
+        if exit_code != 0:
+            print(f"❌ Command '{command}' failed:")
+            print(f"Exit code: {exit_code}")
+            return False
         
-        # If we get here, command succeeded
         print(f"✅ Command '{command}' completed successfully")
         return True
         
-    except docker.errors.ContainerError as e:
-        print(f"❌ Command '{command}' failed:")
-        print(f"Exit code: {e.exit_status}")
-        print(f"Error: {e.stderr.decode('utf-8', errors='replace') if e.stderr else 'No stderr'}")
-        return False
     except Exception as e:
         print(f"❌ Error running command '{command}': {e}")
         return False
-    finally:
-        # Cleanup
-        try:
-            if 'temp_home' in locals() and os.path.exists(temp_home):
-                shutil.rmtree(temp_home, ignore_errors=True)
-        except:
-            pass
 
 def create_run_directory() -> str:
     """
@@ -195,7 +298,7 @@ def create_run_directory() -> str:
         print(f"✅ Using existing run directory: {run_dir}")
         
         # Get tutorial directory
-        tutorial_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tutorials', 'pitzDaily')
+        tutorial_dir = LOCAL_TUTORIAL_DIR
         
         # Copy all files from tutorial directory to run directory
         print(f"📂 Copying files from tutorial directory: {tutorial_dir}")
@@ -260,8 +363,7 @@ def create_run_directory() -> str:
     
     # Create a new run directory in the current working directory
     timestamp = time.strftime("%Y%m%d_%H%M%S")
-    base_runs_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'runs')
-    run_dir = os.path.join(base_runs_dir, f'run_{timestamp}')
+    run_dir = os.path.join(RUNS_DIR, f'run_{timestamp}')
     
     # Clean up any existing incomplete run directories
     if os.path.exists(run_dir):
@@ -270,10 +372,7 @@ def create_run_directory() -> str:
         except Exception as e:
             print(f"⚠️  Warning: Could not clean up existing run directory: {e}")
     
-    # Create the base runs directory if it doesn't exist
-    os.makedirs(base_runs_dir, exist_ok=True, mode=0o755)
-    
-    # Create the run directory
+    # Create the run directory, and the runs directory above it if needed
     os.makedirs(run_dir, exist_ok=True, mode=0o755)
     
     # Get the tutorial directory
@@ -325,7 +424,7 @@ def create_run_directory() -> str:
 def get_tutorial_case_dir() -> str:
     """Get the path to the tutorial case directory"""
     return os.path.join(
-        os.path.dirname(os.path.abspath(__file__)), 
+        SCRIPT_DIR,
         "tutorials",
         "incompressible",
         "simpleFoam",
@@ -378,8 +477,7 @@ def setup_tutorial_case() -> str:
         str: Path to the tutorial directory if successful, empty string otherwise
     """
     # Use a local directory in the application directory
-    app_dir = os.path.dirname(os.path.abspath(__file__))
-    local_tutorial_dir = os.path.join(app_dir, 'tutorials', 'pitzDaily')
+    local_tutorial_dir = LOCAL_TUTORIAL_DIR
     
     # Create the directory if it doesn't exist with proper permissions
     try:
@@ -414,37 +512,35 @@ def setup_tutorial_case() -> str:
     
     # Create a temporary directory with a random name to avoid conflicts
     import tempfile
-    temp_dir = tempfile.mkdtemp(prefix='foamchalak_tmp_', dir=app_dir)
+    temp_dir = tempfile.mkdtemp(prefix='foamchalak_tmp_', dir=SCRIPT_DIR)
     try:
         os.chmod(temp_dir, 0o755)  # Ensure temp directory is accessible
         
         client = docker.from_env()
         
-        # Clean up any existing files in temp directory
-        for item in os.listdir(temp_dir):
-            item_path = os.path.join(temp_dir, item)
-            try:
-                if os.path.isdir(item_path):
-                    shutil.rmtree(item_path)
-                else:
-                    os.unlink(item_path)
-            except Exception as e:
-                print(f"⚠️ Warning: Could not remove {item_path}: {e}")
+        # Read the tutorial out of a created (never started) container; no
+        # container runtime or in-container copy is needed
+        container = client.containers.create("haldardhruv/ubuntu_noble_openfoam:v2412")
+        try:
+            bits, _ = container.get_archive(TUTORIAL_SRC)
+            archive = io.BytesIO(b"".join(bits))
+        finally:
+            container.remove(force=True)
         
-        # Run a container to extract the tutorial files
-        container = client.containers.run(
-            "haldardhruv/ubuntu_noble_openfoam:v2412",
-            command=["bash", "-c", """
-                mkdir -p /mnt/tutorial && 
-                cp -r /usr/lib/openfoam/openfoam2412/tutorials/incompressible/simpleFoam/pitzDaily/. /mnt/tutorial/ && 
-                chmod -R 755 /mnt/tutorial
-            """],
-            volumes={
-                temp_dir: {"bind": "/mnt/tutorial", "mode": "rw"}
-            },
-            remove=True,
-            user="root"
-        )
+        with tarfile.open(fileobj=archive, mode="r:") as tar:
+            # Strip the leading pitzDaily/ so files land directly in temp_dir,
+            # and set permissions here so the copies need no chmod pass
+            members = []
+            for member in tar.getmembers():
+                parts = member.name.split("/", 1)
+                if len(parts) < 2 or not parts[1]:
+                    continue
+                member.name = parts[1]
+                if os.path.isabs(member.name) or ".." in member.name.split("/"):
+                    raise tarfile.TarError(f"Unsafe path in tutorial archive: {member.name}")
+                member.mode = 0o755 if member.isdir() else 0o644
+                members.append(member)
+            tar.extractall(temp_dir, members=members)
         
         # Ensure local tutorial directory exists and is writable
         os.makedirs(local_tutorial_dir, exist_ok=True, mode=0o755)
@@ -463,19 +559,6 @@ def setup_tutorial_case() -> str:
             except Exception as e:
                 print(f"⚠️ Warning: Could not copy {src} to {dst}: {e}")
         
-        # Set permissions on the copied files
-        for root, dirs, files in os.walk(local_tutorial_dir):
-            for d in dirs:
-                try:
-                    os.chmod(os.path.join(root, d), 0o755)
-                except Exception as e:
-                    print(f"⚠️ Warning: Could not set permissions on directory {d}: {e}")
-            for f in files:
-                try:
-                    os.chmod(os.path.join(root, f), 0o644)
-                except Exception as e:
-                    print(f"⚠️ Warning: Could not set permissions on file {f}: {e}")
-        
         print(f"✅ Successfully extracted tutorial to: {local_tutorial_dir}")
         return local_tutorial_dir
         
@@ -501,7 +584,7 @@ def create_run_directory() -> str:
         print(f"✅ Using existing run directory: {run_dir}")
         
         # Get tutorial directory
-        tutorial_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tutorials', 'pitzDaily')
+        tutorial_dir = LOCAL_TUTORIAL_DIR
         
         # Copy all files from tutorial directory to run directory
         print(f"📂 Copying files from tutorial directory: {tutorial_dir}")
@@ -941,8 +1024,7 @@ mergePatchPairs
     
     # Create a new run directory in the current working directory
     timestamp = time.strftime("%Y%m%d_%H%M%S")
-    base_runs_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'runs')
-    run_dir = os.path.join(base_runs_dir, f'run_{timestamp}')
+    run_dir = os.path.join(RUNS_DIR, f'run_{timestamp}')
     
     # Clean up any existing incomplete run directories
     if os.path.exists(run_dir):
@@ -951,10 +1033,7 @@ mergePatchPairs
         except Exception as e:
             print(f"⚠️  Warning: Could not clean up existing run directory: {e}")
     
-    # Create the base runs directory if it doesn't exist
-    os.makedirs(base_runs_dir, exist_ok=True, mode=0o755)
-    
-    # Create the run directory
+    # Create the run directory, and the runs directory above it if needed
     os.makedirs(run_dir, exist_ok=True, mode=0o755)
     
     # Get the tutorial directory
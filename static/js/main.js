@@ -32,6 +32,10 @@ document.addEventListener('DOMContentLoaded', function() {
     // State
     let isRunning = false;
     let currentRunId = null;
+    // Run events that arrive while the start request is in flight, replayed
+    // once the run id is known
+    let startPending = false;
+    let pendingEvents = [];
     let runStartTime = null;
     let runTimer = null;
     let autoScrollEnabled = true;
@@ -77,10 +81,11 @@ document.addEventListener('DOMContentLoaded', function() {
         socket.on('reconnect_attempt', handleReconnectAttempt);
         socket.on('reconnect', handleReconnect);
         socket.on('reconnect_error', handleReconnectError);
-        socket.on('output', handleSocketOutput);
-        socket.on('simulation_complete', handleSimulationComplete);
-        socket.on('step_update', handleStepUpdate);
-        socket.on('error', handleSocketError);
+        socket.on('output', deferWhileStarting(handleSocketOutput));
+        socket.on('output_batch', deferWhileStarting(handleSocketOutputBatch));
+        socket.on('simulation_complete', deferWhileStarting(handleSimulationComplete));
+        socket.on('step_update', deferWhileStarting(handleStepUpdate));
+        socket.on('error', deferWhileStarting(handleSocketError));
 
         // Page visibility change
         document.addEventListener('visibilitychange', handleVisibilityChange);
@@ -154,10 +159,35 @@ document.addEventListener('DOMContentLoaded', function() {
     }
     
     // Socket.IO event handlers
+    
+    // The server subscribes us to a new run before replying, so hold its
+    // events until the reply tells us which run they belong to
+    function deferWhileStarting(handler) {
+        return data => {
+            if (startPending) {
+                pendingEvents.push([handler, data]);
+            } else {
+                handler(data);
+            }
+        };
+    }
+    
+    function flushPendingEvents() {
+        const events = pendingEvents;
+        startPending = false;
+        pendingEvents = [];
+        events.forEach(([handler, data]) => handler(data));
+    }
+    
     function handleSocketConnect() {
         console.log('Connected to WebSocket');
         updateSystemStatus('connected', 'Connected to server');
         showToast('Connected to server', 'success');
+        
+        // Rooms don't survive a reconnect, so rejoin the current run
+        if (currentRunId) {
+            socket.emit('join_run', { run_id: currentRunId });
+        }
     }
 
     function handleSocketDisconnect(reason) {
@@ -190,9 +220,22 @@ document.addEventListener('DOMContentLoaded', function() {
             updateLineCount(1);
         }
     }
+
+    function handleSocketOutputBatch(batch) {
+        if (currentRunId && batch.run_id === currentRunId) {
+            // Repeated lines arrive as [text, count] pairs
+            batch.lines.forEach(line => {
+                const text = Array.isArray(line) ? `${line[0]} (x${line[1]})` : line;
+                appendOutput(text, batch.timestamp);
+            });
+            // A collapsed pair stands for count lines
+            updateLineCount(batch.lines.reduce((n, line) => n + (Array.isArray(line) ? line[1] : 1), 0));
+        }
+    }
     
     // Handle step updates from the server
     function handleStepUpdate(data) {
+        if (data.run_id && data.run_id !== currentRunId) return;
         const { step, status } = data;
         const stepIndex = simulationSteps.findIndex(s => s.name === step);
         
@@ -241,7 +284,8 @@ document.addEventListener('DOMContentLoaded', function() {
     }
 
     function handleSimulationComplete(data) {
-        if (data.run_id === currentRunId) {
+        // A rejoin can replay the event for a run we already finished
+        if (data.run_id === currentRunId && isRunning) {
             stopRunTimer();
             isRunning = false;
             setUIState(false);
@@ -307,14 +351,17 @@ document.addEventListener('DOMContentLoaded', function() {
             setUIState(true);
             appendOutput('🚀 Starting simulation...');
             
-            currentRunId = `run_${Date.now()}_${Math.random().toString(36).substr(2, 9)}`;
+            currentRunId = null;
+            startPending = true;
+            pendingEvents = [];
             
             const response = await fetch('/api/run_simulation', {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
                 body: JSON.stringify({
                     docker_image: dockerImage.value,
-                    case_dir: caseDir.value
+                    case_dir: caseDir.value,
+                    sid: socket.id
                 })
             });
             
@@ -325,6 +372,9 @@ document.addEventListener('DOMContentLoaded', function() {
             }
             
             currentRunId = data.run_id;
+            // Also joins the room if the server couldn't subscribe us, and
+            // replays simulation_complete if the run has already finished
+            socket.emit('join_run', { run_id: currentRunId });
             appendOutput(`✅ Simulation started with ID: ${data.run_id}`);
             appendOutput(`📂 Run directory: ${data.run_dir}`);
             
@@ -333,8 +383,11 @@ document.addEventListener('DOMContentLoaded', function() {
                 runDetails.innerHTML = '';
             }
             
+            flushPendingEvents();
         } catch (error) {
             console.error('Error:', error);
+            startPending = false;
+            pendingEvents = [];
             appendOutput(`❌ Error: ${error.message}`, null, 'error');
             setUIState(false);
         }
@@ -939,7 +992,7 @@ document.addEventListener('DOMContentLoaded', function() {
                     `;
                     
                     if (!isHidden && errorLogs.children.length === 0) {
-                        fetchErrorLogs(data.log_file, errorLogs);
+                        fetchErrorLogs(data.run_id, errorLogs);
                     }
                 });
             }
@@ -948,11 +1001,11 @@ document.addEventListener('DOMContentLoaded', function() {
 
 
     // Helper function to fetch error logs
-    async function fetchErrorLogs(logFilePath, container) {
-        if (!logFilePath) return;
+    async function fetchErrorLogs(runId, container) {
+        if (!runId) return;
         
         try {
-            const response = await fetch(`/api/logs?path=${encodeURIComponent(logFilePath)}`);
+            const response = await fetch(`/api/logs/${encodeURIComponent(runId)}`);
             if (!response.ok) throw new Error('Failed to fetch logs');
             
             const logs = await response.text();
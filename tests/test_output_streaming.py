@@ -0,0 +1,113 @@
+"""Tests for streaming step output to clients (LineBatcher, iter_output_lines)
+
+Run with: python -m unittest discover tests
+"""
+import os
+import sys
+import subprocess
+import threading
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app
+
+
+def count_lines(event, data):
+    """Number of output lines an emitted event stands for"""
+    if event == 'output':
+        return 1
+    return sum(line[1] if isinstance(line, list) else 1 for line in data['lines'])
+
+
+class LineBatcherTest(unittest.TestCase):
+    def setUp(self):
+        self.events = []
+        patcher = mock.patch.object(app.socketio, 'emit',
+                                    side_effect=lambda event, data, **kwargs: self.events.append((event, data)))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(app.recent_output.pop, 'test-run', None)
+
+    def test_no_lines_lost(self):
+        # One large read followed by many small ones, with repeats
+        batcher = app.LineBatcher('test-run')
+        batcher.add_lines([f'Time = {i}' for i in range(2000)])
+        for j in range(3000):
+            batcher.add_lines([f'x {j}', f'x {j}', 'y'])
+        batcher.close()
+
+        self.assertEqual(sum(count_lines(e, d) for e, d in self.events), 2000 + 3 * 3000)
+
+    def test_repeats_collapsed_in_order(self):
+        batcher = app.LineBatcher('test-run')
+        batcher.add_lines(['a', 'b', 'b', 'b', 'c'])
+        batcher.close()
+
+        lines = [line for e, d in self.events if e == 'output_batch' for line in d['lines']]
+        self.assertEqual(lines, ['a', ['b', 3], 'c'])
+
+    def test_stalled_emitter_drops_oldest(self):
+        # Block the emitter so the queue fills and the reader has to drop
+        emitting = threading.Event()
+        release = threading.Event()
+
+        def blocking_emit(event, data, **kwargs):
+            emitting.set()
+            release.wait()
+            self.events.append((event, data))
+
+        with mock.patch.object(app.socketio, 'emit', side_effect=blocking_emit), \
+                mock.patch.object(app, 'OUTPUT_QUEUE_SIZE', 2), \
+                mock.patch.object(app, 'OUTPUT_STALL_TIMEOUT', 0.05):
+            batcher = app.LineBatcher('test-run')
+            batcher.add_lines(['first'])
+            self.assertTrue(emitting.wait(5))
+            started = time.monotonic()
+            for i in range(10):
+                batcher.add_lines([f'chunk {i}'])
+            # The reader waits on a stall rather than blocking forever
+            self.assertLess(time.monotonic() - started, 5)
+            release.set()
+            batcher.close()
+
+        sent = []
+        for event, data in self.events:
+            sent.extend([data['data']] if event == 'output' else data['lines'])
+        self.assertEqual(sent[0], 'first')
+        self.assertLess(len(sent), 11)
+        self.assertEqual(sent[-1], 'chunk 9')
+
+
+class IterOutputLinesTest(unittest.TestCase):
+    def run_child(self, script):
+        process = subprocess.Popen([sys.executable, '-c', script],
+                                   stdout=subprocess.PIPE, bufsize=0)
+        try:
+            return [line for lines in app.iter_output_lines(process) for line in lines]
+        finally:
+            process.stdout.close()
+            process.wait()
+
+    def test_split_utf8_and_partial_last_line(self):
+        # 'é' is split across two writes and the last line has no newline
+        script = (
+            "import sys, time\n"
+            "out = sys.stdout.buffer\n"
+            "out.write(b'caf\\xc3'); out.flush(); time.sleep(0.2)\n"
+            "out.write(b'\\xa9 ok\\nsec'); out.flush(); time.sleep(0.2)\n"
+            "out.write(b'ond\\nend'); out.flush()\n"
+        )
+        self.assertEqual(self.run_child(script), ['café ok', 'second', 'end'])
+
+    def test_output_left_at_exit_is_drained(self):
+        script = "import sys; sys.stdout.write('line\\n' * 100000 + 'last')"
+        lines = self.run_child(script)
+        self.assertEqual(len(lines), 100001)
+        self.assertEqual(lines[-1], 'last')
+
+
+if __name__ == '__main__':
+    unittest.main()